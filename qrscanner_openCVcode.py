@@ -1,158 +1,453 @@
 import cv2
-from pyzbar.pyzbar import decode
-import pandas as pd
-from datetime import datetime
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import os
+import queue
+import threading
+import time
 import numpy as np
-from openpyxl.styles import PatternFill
+import xlsxwriter
+
+try:
+    from pyzbar.pyzbar import decode as zbar_decode
+except ImportError:  # Only needed for backend="pyzbar"
+    zbar_decode = None
 
 class MultiQRCodeScanner:
-    def __init__(self, camera_index=0, excel_path="multi_qr_codes.xlsx"):
+    COLUMNS = ['timestamp', 'frame_number', 'qr_content', 'qr_type', 'status', 'scan_count']
+    DUPLICATE_FORMAT = {'bg_color': '#FF0000'}  # Red background for duplicate rows
+    SAVE_COST_FACTOR = 5  # Wait at least this many times the last save's duration before the next
+
+    def __init__(self, camera_index=0, excel_path="multi_qr_codes.xlsx",
+                 save_interval=2, scan_scale=0.5, motion_threshold=2.0, display_fps=15,
+                 tile_decode=False, tile_overlap=128, full_scan_interval=10,
+                 backend="pyzbar"):
+        if backend not in ("pyzbar", "opencv"):
+            raise ValueError(f"Unknown backend {backend!r}, expected 'pyzbar' or 'opencv'")
+        if backend == "pyzbar" and zbar_decode is None:
+            raise ImportError("pyzbar is required for backend='pyzbar'")
+
         self.camera_index = camera_index
         self.excel_path = excel_path
-        self.captured_codes = {}  # Changed to dict to track count
-        self.qr_data = []
+        self.backend = backend  # "pyzbar" (zbar, all symbologies) or "opencv" (cv2.QRCodeDetector)
+        self.save_interval = save_interval  # Seconds between Excel writes
+        self.scan_scale = scan_scale  # Downscale factor for decoding while no codes are in view
+        self.full_scan_interval = full_scan_interval  # Reduced-scale scans between full resolution passes
+        self.motion_threshold = motion_threshold  # Mean pixel change below which a frame is skipped
+        self.display_fps = display_fps  # Maximum rate at which frames are shown
+        self.tile_decode = tile_decode  # Decode 2x2 tiles in parallel; only pays off on large frames
+        self.tile_overlap = tile_overlap  # Frame pixels shared by neighbouring tiles, at least one QR code wide
+        self.captured_codes = Counter()  # Scan count per raw QR payload (bytes for zbar, str for OpenCV)
+        # Scan records stored column-wise, one list per entry in COLUMNS
+        self._col_timestamp = []
+        self._col_frame_number = []
+        self._col_qr_content = []
+        self._col_qr_type = []
+        self._col_status = []
+        self._col_scan_count = []
+        self._columns = (self._col_timestamp, self._col_frame_number, self._col_qr_content,
+                         self._col_qr_type, self._col_status, self._col_scan_count)
         self.cap = None
         self.frame_count = 0
-        self.last_save_time = datetime.now()
-        
+        self._scan_scale = scan_scale
+        self._prev_small = None  # Thumbnail of the last frame that was decoded
+        self._codes_in_last_frame = False
+        self._text_cache = {}  # Raw zbar payload bytes -> decoded text
+        self._last_scan_full = False  # Whether the last decoded frame was scanned at full resolution
+        self._reduced_scans = 0  # Scans at scan_scale since the last full resolution pass
+        self._ts_sec = None  # Second the cached timestamp string was formatted for
+        self._ts_str = ''
+        self._overlay_key = None  # (frame shape, codes in frame, unique codes) the overlay was rendered for
+        self._overlay = None
+        self._overlay_mask = None
+        self._overlay_region = None
+
+        self._queued_rows = 0  # Records the writer thread has been told about
+
+        # Excel I/O runs on a writer thread so it never blocks the capture loop
+        self._write_q = None
+        self._writer = None
+
+        # Latest-frame slot filled by the grabber thread while the main thread decodes
+        self._frame_lock = threading.Lock()
+        self._frame_ready = threading.Event()
+        self._latest_frame = None
+        self._latest_frame_id = 0
+        self._grabbing = False
+        self._grabber = None
+        self._last_show = 0.0
+
+        # Both backends release the GIL while scanning, so tiles can be decoded on worker threads.
+        # Each tile gets its own OpenCV detector since one instance shouldn't be shared across threads.
+        self._detector = cv2.QRCodeDetector()
+        self._pool = None  # Created on first tiled decode, shut down when scanning stops
+        self._tile_detectors = [cv2.QRCodeDetector() for _ in range(4)] if tile_decode else None
+
     def initialize_camera(self):
         """Initialize the camera capture"""
+        # Cap OpenCV's worker threads so they don't compete with the grabber and the GUI
+        cv2.setUseOptimized(True)
+        cv2.setNumThreads(int(os.environ.get("QR_CV_THREADS", "2")))
+
         self.cap = cv2.VideoCapture(self.camera_index)
         if not self.cap.isOpened():
             raise Exception("Could not open camera")
             
+        # Request compressed MJPG frames so 1080p fits USB bandwidth at full frame rate
+        self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+        self.cap.set(cv2.CAP_PROP_FPS, 30)
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Don't queue stale frames in the driver
+
         # Set camera resolution if needed
         self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1920)
         self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 1080)
         
-    def draw_qr_info(self, frame, decoded_objects):
-        """Draw QR code information on frame"""
-        for idx, obj in enumerate(decoded_objects):
-            # Get the QR code points
-            points = obj.polygon
-            if points:
-                # Draw the QR code boundary
-                pts = np.array([(p.x, p.y) for p in points], np.int32)
-                pts = pts.reshape((-1, 1, 2))
-                
+    def draw_qr_info(self, frame, codes, scale=1.0):
+        """Draw QR code information on frame, mapping corners detected at `scale` back to frame size"""
+        if codes:
+            # Get the corners of every code in the frame as one flat array
+            counts = [len(pts) for _, _, pts, _ in codes]
+            flat = np.concatenate([pts for _, _, pts, _ in codes])
+            if scale != 1.0:
+                flat = flat / scale
+            polys = np.split(flat.astype(np.int32).reshape((-1, 1, 2)), np.cumsum(counts)[:-1])
+
+            outlines = {(0, 0, 255): [], (0, 255, 0): []}
+            labels = []
+            for idx, ((key, data, _, _), pts) in enumerate(zip(codes, polys)):
+                if not len(pts):
+                    continue
+
                 # Check if this is a duplicate QR code
-                try:
-                    data = obj.data.decode('utf-8')
-                    color = (0, 0, 255) if data in self.captured_codes else (0, 255, 0)  # Red if duplicate, green if new
-                    cv2.polylines(frame, [pts], True, color, 2)
-                    
-                    # Add a label with QR code content
-                    x = points[0].x
-                    y = points[0].y
-                    truncated_data = data[:20] + "..." if len(data) > 20 else data
-                    cv2.putText(frame, f"QR {idx+1}: {truncated_data}", 
-                              (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 
-                              0.5, color, 2)
-                except:
-                    pass
+                color = (0, 0, 255) if key in self.captured_codes else (0, 255, 0)  # Red if duplicate, green if new
+                outlines[color].append(pts)
+
+                # Add a label with QR code content
+                x, y = pts[0, 0]
+                truncated_data = data[:20] + "..." if len(data) > 20 else data
+                labels.append((f"QR {idx+1}: {truncated_data}", (int(x), int(y) - 10), color))
+
+            # Draw the QR code boundaries with one call per color
+            for color, color_polys in outlines.items():
+                if color_polys:
+                    cv2.polylines(frame, color_polys, True, color, 2)
+
+            for text, org, color in labels:
+                cv2.putText(frame, text, org, cv2.FONT_HERSHEY_SIMPLEX,
+                            0.5, color, 2)
                 
+        # Copy the cached counter text onto the frame
+        self._update_overlay(frame.shape, len(codes), len(self.captured_codes))
+        region = frame[self._overlay_region]
+        region[self._overlay_mask] = self._overlay[self._overlay_mask]
+        
+        return frame
+
+    def _update_overlay(self, shape, codes_in_frame, unique_codes):
+        """Re-render the counter text overlay only when the frame size or counts change"""
+        key = (shape, codes_in_frame, unique_codes)
+        if key == self._overlay_key:
+            return
+
+        overlay = np.zeros(shape, np.uint8)
+
         # Add counter for total QR codes in frame
-        cv2.putText(frame, f"QR Codes in frame: {len(decoded_objects)}", 
+        cv2.putText(overlay, f"QR Codes in frame: {codes_in_frame}", 
                    (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 
                    1, (0, 255, 0), 2)
         
         # Add counter for unique codes captured
-        cv2.putText(frame, f"Total unique codes: {len(self.captured_codes)}", 
+        cv2.putText(overlay, f"Total unique codes: {unique_codes}", 
                    (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 
                    1, (0, 255, 0), 2)
-        
-        return frame
+
+        # Keep only the bounding box of the text so blitting touches as few pixels as possible
+        mask = overlay.any(2)
+        ys, xs = np.nonzero(mask)
+        self._overlay_region = (slice(ys.min(), ys.max() + 1), slice(xs.min(), xs.max() + 1))
+        self._overlay = overlay[self._overlay_region]
+        self._overlay_mask = mask[self._overlay_region]
+        self._overlay_key = key
+
+    def _decode_text(self, raw):
+        """Return the text of a zbar payload, decoding each distinct payload only once"""
+        text = self._text_cache.get(raw)
+        if text is None:
+            text = self._text_cache[raw] = raw.decode('utf-8', 'replace')
+        return text
+
+    def _detect(self, detector, gray):
+        """Return (key, text, corners, type) per located code; key is the raw payload, None if undecoded"""
+        if self.backend == "pyzbar":
+            return [(obj.data, self._decode_text(obj.data),
+                     np.array(obj.polygon, np.float32).reshape((-1, 2)), obj.type)
+                    for obj in zbar_decode(gray)]
+
+        ok, texts, points, _ = detector.detectAndDecodeMulti(gray)
+        if not ok:
+            return []
+        # Codes that were located but could not be decoded come back with empty text
+        return [(text or None, text, pts, 'QRCODE') for text, pts in zip(texts, points)]
+
+    def _scan(self, gray, scale):
+        """Locate and decode codes in gray, resized from the frame by `scale`, tiled if tile_decode is set"""
+        return self._decode_tiled(gray, scale) if self.tile_decode else self._detect(self._detector, gray)
+
+    def _decode_tiled(self, gray, scale):
+        """Decode a 2x2 grid of overlapping tiles in parallel and merge codes found in several tiles"""
+        h, w = gray.shape[:2]
+        half_h, half_w = h // 2, w // 2
+        overlap = int(round(self.tile_overlap * scale))  # tile_overlap is in frame pixels
+        rows = ((0, min(h, half_h + overlap)), (max(0, half_h - overlap), h))
+        cols = ((0, min(w, half_w + overlap)), (max(0, half_w - overlap), w))
+
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=4)
+
+        tiles = []
+        detectors = iter(self._tile_detectors)
+        for y0, y1 in rows:
+            for x0, x1 in cols:
+                future = self._pool.submit(self._detect, next(detectors), gray[y0:y1, x0:x1])
+                tiles.append((x0, y0, future))
+
+        kept = []  # (key, center, code)
+        for x0, y0, future in tiles:
+            for key, text, pts, qr_type in future.result():
+                # Move the corners from tile to frame coordinates
+                pts = pts + (x0, y0)
+
+                # The same code seen in two overlapping tiles has the same key and nearly the
+                # same center; a match closer than half the code's size is treated as one code
+                center = pts.mean(axis=0)
+                radius = max(np.ptp(pts, axis=0).max() / 2, 1.0)
+                if any(kept_key == key and np.hypot(*(kept_center - center)) < radius
+                       for kept_key, kept_center, _ in kept):
+                    continue
+                kept.append((key, center, (key, text, pts, qr_type)))
+
+        return [code for _, _, code in kept]
         
     def process_frame(self, frame):
         """Process a single frame and detect QR codes"""
         self.frame_count += 1
-        decoded_objects = decode(frame)
-        codes_in_frame = 0
+
+        # The detector only looks at luminance, and a smaller image is much cheaper to scan
+        scale = self._scan_scale
+        full_gray = gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        # Skip decoding while the scene matches the last scanned frame and it had no codes,
+        # but only once that frame was scanned at full resolution
+        small = cv2.resize(gray, (128, 72), interpolation=cv2.INTER_AREA)
+        static = (self._prev_small is not None and not self._codes_in_last_frame
+                  and cv2.absdiff(small, self._prev_small).mean() < self.motion_threshold)
+        if static and self._last_scan_full:
+            found = []
+        else:
+            # Codes too small to decode at scan_scale are still read by a full resolution
+            # pass on a static scene and on every full_scan_interval-th scan
+            if static or self._reduced_scans >= self.full_scan_interval:
+                scale = 1.0
+            self._last_scan_full = scale == 1.0
+            self._reduced_scans = 0 if scale == 1.0 else self._reduced_scans + 1
+
+            self._prev_small = small
+            if scale != 1.0:
+                gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            found = self._scan(gray, scale)
+
+            # A code located but not decoded at reduced scale gets another try at full resolution
+            if scale != 1.0 and any(key is None for key, _, _, _ in found):
+                scale = 1.0
+                self._last_scan_full = True
+                self._reduced_scans = 0
+                found = self._scan(full_gray, 1.0)
+        codes = [code for code in found if code[0] is not None]
+
+        # Keep scanning at full resolution while codes are in view, decoded or not,
+        # so the motion gate never skips a frame with an unread code in it
+        self._codes_in_last_frame = bool(found)
+        self._scan_scale = 1.0 if found else self.scan_scale
+
+        # Timestamps have one-second resolution, so format them at most once per second
+        now = int(time.time())
+        if now != self._ts_sec:
+            self._ts_sec = now
+            self._ts_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))
         
-        for obj in decoded_objects:
-            try:
-                data = obj.data.decode('utf-8')
-                codes_in_frame += 1
-                
-                # Track if this is a duplicate
-                is_duplicate = data in self.captured_codes
-                if data in self.captured_codes:
-                    self.captured_codes[data] += 1
-                else:
-                    self.captured_codes[data] = 1
-                
-                self.qr_data.append({
-                    'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    'frame_number': self.frame_count,
-                    'qr_content': data,
-                    'qr_type': obj.type,
-                    'status': 'duplicate' if is_duplicate else 'new',
-                    'scan_count': self.captured_codes[data]
-                })
-                
-                print(f"{'Duplicate' if is_duplicate else 'New'} QR Code detected: {data}")
-                    
-            except Exception as e:
-                print(f"Error processing QR code: {str(e)}")
+        for key, data, _, qr_type in codes:
+            # Track if this is a duplicate, keyed on the raw payload so distinct payloads
+            # that decode to the same text are not mistaken for each other
+            self.captured_codes[key] += 1
+            scan_count = self.captured_codes[key]
+            is_duplicate = scan_count > 1
+            
+            self._col_timestamp.append(self._ts_str)
+            self._col_frame_number.append(self.frame_count)
+            self._col_qr_content.append(data)
+            self._col_qr_type.append(qr_type)
+            self._col_status.append('duplicate' if is_duplicate else 'new')
+            self._col_scan_count.append(scan_count)
+
+            print(f"{'Duplicate' if is_duplicate else 'New'} QR Code detected: {data}")
         
         # Draw information on frame
-        frame = self.draw_qr_info(frame, decoded_objects)
+        frame = self.draw_qr_info(frame, codes, scale)
         
-        # Save to Excel if codes were detected in this frame
-        if codes_in_frame > 0:
-            self.save_to_excel()
-            
+        # Tell the writer thread how many records exist without waiting on it
+        total_rows = len(self._col_status)
+        if self._writer is not None and total_rows > self._queued_rows:
+            try:
+                self._write_q.put_nowait(total_rows)
+                self._queued_rows = total_rows
+            except queue.Full:
+                pass  # Writer is busy; the new count is sent with the next frame
+
         return frame
-    
-    def save_to_excel(self):
-        """Save the captured QR code data to Excel with formatting"""
+
+    def _writer_loop(self):
+        """Save the records to Excel periodically until a None sentinel arrives"""
+        # Write the header right away so an unusable excel_path is reported at startup
+        self.save_to_excel(0)
+        ready_rows = saved_rows = 0
+        last_save = time.monotonic()
+        save_gap = self.save_interval
+
+        while True:
+            try:
+                rows = self._write_q.get(timeout=self.save_interval)
+            except queue.Empty:
+                rows = ready_rows
+
+            if rows is None:
+                self.save_to_excel(ready_rows)
+                break
+            ready_rows = rows
+
+            # Debounce Excel writes instead of rewriting the file on every frame
+            if ready_rows > saved_rows and time.monotonic() - last_save >= save_gap:
+                started = time.monotonic()
+                if self.save_to_excel(ready_rows):
+                    saved_rows = ready_rows
+                last_save = time.monotonic()
+
+                # Each save rebuilds the whole file while holding the GIL, so space saves out
+                # as the session grows to keep the writer's share of CPU bounded
+                save_gap = max(self.save_interval, self.SAVE_COST_FACTOR * (last_save - started))
+
+    def save_to_excel(self, rows):
+        """Save the first `rows` records to Excel with formatting, replacing the file atomically"""
+        root, ext = os.path.splitext(self.excel_path)
+        tmp_path = f"{root}.tmp{ext}"
         try:
-            # Create DataFrame
-            df = pd.DataFrame(self.qr_data)
-            
-            # Save to Excel
-            with pd.ExcelWriter(self.excel_path, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False)
-                
-                # Access the workbook and sheet
-                workbook = writer.book
-                worksheet = writer.sheets['Sheet1']
-                
-                # Define fill patterns
-                red_fill = PatternFill(start_color='FFFF0000',
-                                     end_color='FFFF0000',
-                                     fill_type='solid')
-                
-                # Apply conditional formatting
-                for idx, row in enumerate(df['status'], start=2):  # start=2 because excel uses 1-based index and we have header
-                    if row == 'duplicate':
-                        for col in range(1, len(df.columns) + 1):
-                            worksheet.cell(row=idx, column=col).fill = red_fill
-                
-            print(f"Excel file updated with {len(self.qr_data)} total records")
+            # Payloads are stored verbatim: no hyperlink or formula conversion of URLs or '=...'
+            workbook = xlsxwriter.Workbook(tmp_path, {'constant_memory': True,
+                                                      'strings_to_urls': False,
+                                                      'strings_to_formulas': False})
+            worksheet = workbook.add_worksheet('Sheet1')
+            red_format = workbook.add_format(self.DUPLICATE_FORMAT)
+            worksheet.write_row(0, 0, self.COLUMNS)
+
+            records = zip(*(col[:rows] for col in self._columns))
+            for idx, (record, status) in enumerate(zip(records, self._col_status[:rows]), start=1):
+                worksheet.write_row(idx, 0, record,
+                                    red_format if status == 'duplicate' else None)
+            workbook.close()
+
+            # Readers of excel_path never see a half-written file
+            os.replace(tmp_path, self.excel_path)
+            print(f"Excel file updated with {rows} total records")
+            return True
         except Exception as e:
             print(f"Error saving to Excel: {str(e)}")
+            return False
+
+    def start_writer(self):
+        """Start the Excel writer thread, which saves the header right away"""
+        self._write_q = queue.Queue(maxsize=8)
+        self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self._writer.start()
+
+    def stop_writer(self):
+        """Send the final record count and wait for the writer thread to save and exit"""
+        if self._writer is None:
+            return
+        self._write_q.put(len(self._col_status))
+        self._queued_rows = len(self._col_status)
+        self._write_q.put(None)
+        self._writer.join()
+        self._writer = None
+
+    def _grab_loop(self):
+        """Read frames continuously, keeping only the most recent one"""
+        while self._grabbing:
+            ret, frame = self.cap.read()
+            with self._frame_lock:
+                if ret:
+                    self._latest_frame = frame
+                    self._latest_frame_id += 1
+                else:
+                    self._grabbing = False
+                self._frame_ready.set()
+
+    def start_grabber(self):
+        """Start reading frames from the camera on a background thread"""
+        self._frame_ready.clear()
+        self._grabbing = True
+        self._grabber = threading.Thread(target=self._grab_loop, daemon=True)
+        self._grabber.start()
+
+    def stop_grabber(self, timeout=1.0):
+        """Stop the grabber thread, waiting at most `timeout` seconds for its last read to finish"""
+        self._grabbing = False
+        if self._grabber is not None:
+            self._grabber.join(timeout=timeout)
+            if self._grabber.is_alive() and self.cap is not None:
+                # A stalled camera can block cap.read() for a long time; releasing the
+                # capture unblocks it, and the daemon thread exits on the failed read
+                self.cap.release()
+            self._grabber = None
     
     def start_scanning(self):
         """Start the scanning process"""
         try:
+            self.start_writer()
             self.initialize_camera()
+            self.start_grabber()
             print("Starting multi QR code scanning...")
             print("Press 'q' to quit")
             
+            last_frame_id = 0
             while True:
-                ret, frame = self.cap.read()
-                if not ret:
-                    print("Failed to grab frame")
+                if self._frame_ready.wait(timeout=0.1):
+                    with self._frame_lock:
+                        self._frame_ready.clear()
+                        frame = self._latest_frame
+                        frame_id = self._latest_frame_id
+                        grabbing = self._grabbing
+
+                    if not grabbing:
+                        print("Failed to grab frame")
+                        break
+
+                    # Only process each captured frame once
+                    if frame_id != last_frame_id:
+                        last_frame_id = frame_id
+
+                        # Process the frame
+                        processed_frame = self.process_frame(frame)
+
+                        # Display the frame, throttled so the GUI doesn't hold back decoding
+                        now = time.monotonic()
+                        if now - self._last_show >= 1.0 / self.display_fps:
+                            cv2.imshow('Multi QR Code Scanner', processed_frame)
+                            self._last_show = now
+                elif not self._grabber.is_alive():
+                    print("Frame grabber stopped")
                     break
                 
-                # Process the frame
-                processed_frame = self.process_frame(frame)
-                
-                # Display the frame
-                cv2.imshow('Multi QR Code Scanner', processed_frame)
-                
-                # Break the loop if 'q' is pressed
+                # Keep the window responsive and break the loop if 'q' is pressed,
+                # even while the camera is not delivering frames
                 if cv2.waitKey(1) & 0xFF == ord('q'):
                     break
                 
@@ -160,10 +455,14 @@ class MultiQRCodeScanner:
             print(f"Error during scanning: {str(e)}")
         
         finally:
+            self.stop_grabber()
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
             if self.cap is not None:
                 self.cap.release()
             cv2.destroyAllWindows()
-            self.save_to_excel()  # Final save
+            self.stop_writer()  # Final save
 
 def main():
     scanner = MultiQRCodeScanner(